@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Track-level alert engine for the detection script
+-------------------------------------------------
+• Merges tracker IDs that belong to the same object: when ByteTrack drops an
+  ID and assigns a new one, the new track is matched to the old alert by
+  position, time since last seen and a cheap colour-histogram embedding
+• Keeps an alert lifecycle per object: new → confirmed → lost (→ confirmed)
+• Returns state-transition events; the caller fires side effects (snapshot,
+  Telegram, voice, web) only on those, not on every frame or cooldown tick
+"""
+
+import itertools
+
+import cv2
+import numpy as np
+
+# Lifecycle states
+NEW, CONFIRMED, LOST = "new", "confirmed", "lost"
+
+# Events returned by AlertEngine.update()
+EV_CONFIRMED = "confirmed"     # object seen long enough → raise the alert
+EV_REACQUIRED = "reacquired"   # lost object is back (same or re-identified track)
+EV_LOST = "lost"               # confirmed object not seen for lost_after seconds
+EV_EXPIRED = "expired"         # object forgotten; its ID will not come back
+
+# Lifecycle timings (confirm_hits, lost_after, ...) come from the detector CONFIG
+REID_MAX_DIST = 1.0       # centre distance, in box diagonals, allowed immediately…
+REID_DIST_PER_SEC = 0.5   # …growing by this much per second of absence
+REID_MIN_SIMILARITY = 0.6
+HIST_BINS = [16, 8]       # hue × saturation
+
+
+def color_embedding(frame, bbox):
+    """L2-normalised hue/saturation histogram of the box contents (None if empty)"""
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = bbox
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(w, x2), min(h, y2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+
+    hsv = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, HIST_BINS, [0, 180, 0, 256]).flatten()
+    norm = np.linalg.norm(hist)
+    return hist / norm if norm > 0 else None
+
+
+class TrackedAlert:
+    """One physical object, possibly seen under several tracker IDs"""
+
+    def __init__(self, alert_id, label, conf, bbox, embedding, now):
+        self.alert_id = alert_id
+        self.label = label
+        self.conf = conf
+        self.bbox = bbox
+        self.embedding = embedding
+        self.snapshot = ""      # image name saved when the alert was confirmed
+        self.state = NEW
+        self.hits = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.track_ids = set()
+
+    def center(self):
+        x1, y1, x2, y2 = self.bbox
+        return (x1 + x2) / 2, (y1 + y2) / 2
+
+    def diagonal(self):
+        x1, y1, x2, y2 = self.bbox
+        return max(1.0, ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5)
+
+
+class AlertEngine:
+    """
+    Maps per-frame tracker detections to deduplicated alerts with a lifecycle
+
+    Args:
+        confirm_hits: consecutive/recent frames before a NEW object is confirmed
+        lost_after: seconds unseen before a confirmed object becomes LOST
+        reid_window: seconds a vanished object can still be re-identified
+        forget_after: seconds unseen before an object is dropped entirely
+    """
+
+    def __init__(self, confirm_hits, lost_after, reid_window, forget_after):
+        self.confirm_hits = confirm_hits
+        self.lost_after = lost_after
+        self.reid_window = reid_window
+        self.forget_after = max(forget_after, reid_window)
+        self.alerts = {}        # alert_id -> TrackedAlert
+        self._tid_map = {}      # tracker id -> alert_id
+        self._prev_seen = set() # alert IDs matched in the previous update()
+        self._ids = itertools.count(1)
+
+    def update(self, frame, labels, confs, tids, bboxes, now):
+        """
+        Feed one frame of detections (parallel lists).
+        Returns (alert_ids, events): the stable alert ID for each detection and
+        a list of (event, TrackedAlert) state transitions.
+        """
+        events = []
+        resolved = [None] * len(tids)
+        seen = set()
+
+        # Known tracker IDs claim their alerts first, so a new track listed
+        # earlier (YOLO orders by confidence) can't steal a live alert
+        for i, (label, tid) in enumerate(zip(labels, tids)):
+            alert = self.alerts.get(self._tid_map.get(tid))
+            if alert is not None and alert.label == label and alert.alert_id not in seen:
+                resolved[i] = alert
+                seen.add(alert.alert_id)
+
+        for i, (label, conf, tid, bbox) in enumerate(zip(labels, confs, tids, bboxes)):
+            if resolved[i] is None:
+                resolved[i] = self._match_new_track(frame, label, conf, tid, bbox, now, seen)
+                seen.add(resolved[i].alert_id)
+
+        for alert, conf, bbox in zip(resolved, confs, bboxes):
+            # Only recent sightings count towards confirmation: isolated
+            # single-frame detections never add up to an alert
+            if alert.state == NEW and now - alert.last_seen > self.lost_after:
+                alert.hits = 0
+            alert.conf = conf
+            alert.bbox = bbox
+            alert.last_seen = now
+            alert.hits += 1
+
+            if alert.state == NEW and alert.hits >= self.confirm_hits:
+                alert.state = CONFIRMED
+                events.append((EV_CONFIRMED, alert))
+            elif alert.state == LOST:
+                alert.state = CONFIRMED
+                events.append((EV_REACQUIRED, alert))
+
+        events.extend(self._age(now, seen))
+        self._prev_seen = seen
+        return [alert.alert_id for alert in resolved], events
+
+    # ----- Internals -----
+    def _match_new_track(self, frame, label, conf, tid, bbox, now, seen):
+        """Tracker ID we have not seen: re-identify it or start a new alert"""
+        embedding = color_embedding(frame, bbox)
+        alert = self._reidentify(label, bbox, embedding, now, seen)
+
+        if alert is None:
+            alert = TrackedAlert(next(self._ids), label, conf, bbox, embedding, now)
+            self.alerts[alert.alert_id] = alert
+        else:
+            print(f"[ALERT] {label} track {tid} re-identified as #{alert.alert_id}")
+            if embedding is not None:
+                alert.embedding = embedding
+
+        alert.track_ids.add(tid)
+        self._tid_map[tid] = alert.alert_id
+        return alert
+
+    def _reidentify(self, label, bbox, embedding, now, seen):
+        x1, y1, x2, y2 = bbox
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        best, best_score = None, None
+
+        for alert in self.alerts.values():
+            # Alerts seen this frame or last frame are still owned by a live track
+            if (alert.label != label or alert.alert_id in seen
+                    or alert.alert_id in self._prev_seen):
+                continue
+            idle = now - alert.last_seen
+            if idle > self.reid_window:
+                continue
+
+            ax, ay = alert.center()
+            dist = ((cx - ax) ** 2 + (cy - ay) ** 2) ** 0.5 / alert.diagonal()
+            max_dist = REID_MAX_DIST + REID_DIST_PER_SEC * idle
+            if dist > max_dist:
+                continue
+
+            if embedding is not None and alert.embedding is not None:
+                similarity = float(np.dot(embedding, alert.embedding))
+                if similarity < REID_MIN_SIMILARITY:
+                    continue
+            else:
+                similarity = REID_MIN_SIMILARITY
+
+            score = similarity - dist / max_dist
+            if best_score is None or score > best_score:
+                best, best_score = alert, score
+        return best
+
+    def _age(self, now, seen):
+        events = []
+        expired = []
+        for alert in self.alerts.values():
+            if alert.alert_id in seen:
+                continue
+            idle = now - alert.last_seen
+            if idle > self.forget_after:
+                expired.append(alert)
+            elif alert.state == CONFIRMED and idle > self.lost_after:
+                alert.state = LOST
+                events.append((EV_LOST, alert))
+
+        for alert in expired:
+            del self.alerts[alert.alert_id]
+            for tid in alert.track_ids:
+                if self._tid_map.get(tid) == alert.alert_id:
+                    del self._tid_map[tid]
+            events.append((EV_EXPIRED, alert))
+        return events
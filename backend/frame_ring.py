@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Shared-memory frame ring between the detection script and the Flask backend
+---------------------------------------------------------------------------
+• The detector is the only client of the ESP32-CAM stream
+• Each captured frame is published together with the detections computed
+  on it, tagged with a monotonically increasing sequence number
+• web_api.py attaches to the ring and reads frames instead of opening its
+  own camera connection, so overlays always match the frame they belong to
+
+Layout (little endian):
+    header : magic, slots, width, height, meta_size, write_seq
+    slot i : seq, timestamp, meta_len, <meta_size bytes of JSON>, <BGR pixels>
+
+Writers bump a slot's seq to 0 before overwriting it and store the real seq
+afterwards; readers check the seq before and after copying so a torn slot is
+never returned.
+"""
+
+import json
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+RING_NAME = "innotech_rover_frames"
+RING_MAGIC = b"RVR1"
+DEFAULT_SLOTS = 4
+DEFAULT_META_SIZE = 16 * 1024   # JSON detections per frame
+
+_HEADER = struct.Struct("<4sIIIIQ")
+_SLOT_HEADER = struct.Struct("<QdI4x")
+_SEQ = struct.Struct("<Q")
+_WRITE_SEQ_OFFSET = _HEADER.size - _SEQ.size
+
+
+class FrameRing:
+    """Fixed-size ring of BGR frames + detection metadata in shared memory"""
+
+    def __init__(self, shm, slots, width, height, meta_size, owner):
+        self._shm = shm
+        self.slots = slots
+        self.width = width
+        self.height = height
+        self.meta_size = meta_size
+        self._owner = owner
+        self._frame_bytes = width * height * 3
+        self._slot_size = _SLOT_HEADER.size + meta_size + self._frame_bytes
+        self._seq = 0
+
+    # ----- Construction -----
+    @classmethod
+    def create(cls, width, height, slots=DEFAULT_SLOTS,
+               meta_size=DEFAULT_META_SIZE, name=RING_NAME):
+        """Create the ring (detector side). Replaces a stale ring of the same name."""
+        frame_bytes = width * height * 3
+        size = _HEADER.size + slots * (_SLOT_HEADER.size + meta_size + frame_bytes)
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:_HEADER.size] = _HEADER.pack(RING_MAGIC, slots, width, height, meta_size, 0)
+        return cls(shm, slots, width, height, meta_size, owner=True)
+
+    @classmethod
+    def attach(cls, name=RING_NAME):
+        """Attach to an existing ring (backend side). Raises FileNotFoundError if absent."""
+        shm = shared_memory.SharedMemory(name=name)
+        # Before Python 3.13 the resource tracker unlinks every segment a process
+        # touched when it exits, which would tear the ring down under the detector.
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+
+        magic, slots, width, height, meta_size, _ = _HEADER.unpack_from(shm.buf, 0)
+        if magic != RING_MAGIC:
+            shm.close()
+            raise ValueError(f"Shared memory '{name}' is not a frame ring")
+        return cls(shm, slots, width, height, meta_size, owner=False)
+
+    # ----- Writer -----
+    def publish(self, frame, detections):
+        """Store a frame and its detections; returns the frame sequence number"""
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f"Frame shape {frame.shape} does not match ring "
+                             f"({self.height}, {self.width}, 3)")
+
+        meta = json.dumps(detections).encode("utf-8")
+        if len(meta) > self.meta_size:
+            meta = b"[]"
+            print(f"[RING] Detections for frame {self._seq + 1} too large — dropped")
+
+        self._seq += 1
+        base = _HEADER.size + (self._seq % self.slots) * self._slot_size
+        buf = self._shm.buf
+
+        _SEQ.pack_into(buf, base, 0)  # mark slot as being written
+        meta_start = base + _SLOT_HEADER.size
+        buf[meta_start:meta_start + len(meta)] = meta
+        pixels_start = meta_start + self.meta_size
+        slot_pixels = np.ndarray((self.height, self.width, 3), dtype=np.uint8,
+                                 buffer=buf, offset=pixels_start)
+        slot_pixels[:] = frame
+        del slot_pixels
+        _SLOT_HEADER.pack_into(buf, base, self._seq, time.time(), len(meta))
+        _SEQ.pack_into(buf, _WRITE_SEQ_OFFSET, self._seq)
+        return self._seq
+
+    # ----- Reader -----
+    def latest_seq(self):
+        """Sequence number of the most recently published frame (0 = none yet)"""
+        return _SEQ.unpack_from(self._shm.buf, _WRITE_SEQ_OFFSET)[0]
+
+    def read_latest(self):
+        """
+        Copy out the newest frame.
+        Returns (seq, timestamp, frame, detections) or None if nothing is available.
+        """
+        for _ in range(3):
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+
+            base = _HEADER.size + (seq % self.slots) * self._slot_size
+            buf = self._shm.buf
+            slot_seq, ts, meta_len = _SLOT_HEADER.unpack_from(buf, base)
+            if slot_seq != seq:
+                continue  # writer is mid-update, try the newer frame
+
+            meta_start = base + _SLOT_HEADER.size
+            meta = bytes(buf[meta_start:meta_start + meta_len])
+            pixels_start = meta_start + self.meta_size
+            frame = np.ndarray((self.height, self.width, 3), dtype=np.uint8,
+                               buffer=buf, offset=pixels_start).copy()
+
+            if _SEQ.unpack_from(buf, base)[0] != seq:
+                continue  # slot was overwritten while copying
+            return seq, ts, frame, json.loads(meta)
+        return None
+
+    # ----- Cleanup -----
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
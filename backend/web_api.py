@@ -4,15 +4,22 @@ Flask Web API for ESP32-CAM Detection
 Serves stream and detection status to React frontend
 """
 
-from flask import Flask, Response, jsonify, request
+from flask import Flask, Response, abort, jsonify, request, send_file
 from flask_cors import CORS
-import requests
+from werkzeug.security import safe_join
+import io
+import math
+import os
 import time
+import threading
 import cv2
 import numpy as np
-from threading import Lock
+from collections import OrderedDict
+from threading import Condition, Lock
 from datetime import datetime
 
+from frame_ring import FrameRing
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
@@ -29,102 +36,256 @@ detection_state = {
 }
 state_lock = Lock()
 
-# ESP32-CAM configuration
-ESP32_STREAM_URL = "http://10.43.145.165:81/stream"
+# Frame source: the detection script publishes frames into shared memory,
+# so the ESP32-CAM only ever serves one client (the detector)
+RING_RETRY_SEC = 1.0      # wait between attach attempts while detector is down
+RING_STALE_SEC = 3.0      # re-attach if no new frame arrives for this long
+RING_POLL_SEC = 0.01
+
+latest_frame = {"seq": 0, "frame": None}
+frame_cond = Condition()
+reader_lock = Lock()
+reader_started = False
+
+# /stream output variants (?w=<width>&q=<jpeg quality>&fps=<max fps>)
+STREAM_DEFAULT_QUALITY = 85
+STREAM_MIN_WIDTH = 160
+STREAM_WIDTH_STEP = 16     # widths are rounded so similar requests share a variant
+STREAM_QUALITY_RANGE = (20, 95)
+STREAM_QUALITY_STEP = 5
+STREAM_MAX_FPS = 30
+VARIANT_IDLE_SEC = 30.0    # forget variants nobody has asked for in this long
+
+
+def draw_overlays(frame, detections):
+    """Draw detection boxes and status banner for the frame they were computed on"""
+    human_detected = False
+
+    for det in detections:
+        label = det.get("label", "unknown")
+        conf = det.get("conf", 0.0)
+        tid = det.get("tid", 0)
+        bbox = det.get("bbox", [])
+
+        if len(bbox) == 4:
+            x1, y1, x2, y2 = bbox
+
+            # Choose color based on label
+            if label == "person":
+                color = (0, 0, 255)  # Red for person
+                human_detected = True
+            elif label == "boat":
+                color = (255, 165, 0)  # Orange for boat
+            else:
+                color = (0, 255, 0)  # Green for others
+
+            # Draw rectangle
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
+
+            # Draw label background
+            label_text = f"{label}#{tid} {int(conf*100)}%"
+            (w, h), _ = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+            cv2.rectangle(frame, (x1, y1-25), (x1+w+10, y1), color, -1)
+
+            # Draw label text
+            cv2.putText(frame, label_text, (x1+5, y1-7),
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+    # Draw detection status banner
+    if human_detected:
+        cv2.rectangle(frame, (10, 10), (400, 60), (0, 0, 255), -1)
+        cv2.putText(frame, "HUMAN DETECTED!", (20, 45),
+                  cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+    return frame
+
+
+def message_frame(text):
+    """Placeholder frame shown while no camera frames are available"""
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    cv2.putText(frame, text, (40, 240),
+               cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
+    return frame
+
+
+class VariantCache:
+    """
+    Encoding cache for /stream: each (width, quality) variant of a frame is
+    resized and JPEG-encoded once, then shared by every viewer that asked for it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._variants = {}   # (width, quality) -> {"seq", "jpeg", "lock", "used"}
+
+    def get(self, seq, frame, width, quality):
+        if width >= frame.shape[1]:
+            width = 0  # no upscaling, so share the native variant
+        key = (width, quality)
+        now = time.time()
+        with self._lock:
+            entry = self._variants.get(key)
+            if entry is None:
+                entry = {"seq": 0, "jpeg": b"", "lock": Lock(), "used": now}
+                self._variants[key] = entry
+            entry["used"] = now
+            for k in [k for k, v in self._variants.items() if now - v["used"] > VARIANT_IDLE_SEC]:
+                del self._variants[k]
+
+        # Per-variant lock: the first viewer encodes, the rest wait and reuse it.
+        # A viewer holding an older frame gets the cached (same or newer) JPEG.
+        with entry["lock"]:
+            if seq > entry["seq"]:
+                entry["jpeg"] = encode_frame(frame, width, quality)
+                entry["seq"] = seq
+            return entry["jpeg"]
+
+
+variant_cache = VariantCache()
+
+
+def encode_frame(frame, width, quality):
+    """Resize (never upscale) and JPEG-encode a frame"""
+    h, w = frame.shape[:2]
+    if width and width < w:
+        frame = cv2.resize(frame, (width, max(1, round(h * width / w))),
+                           interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+def parse_stream_args(args):
+    """Read and normalise ?w=&q=&fps= so near-identical requests map to one variant"""
+    width = args.get('w', default=0, type=int)
+    if width > 0:
+        width = max(STREAM_MIN_WIDTH, width // STREAM_WIDTH_STEP * STREAM_WIDTH_STEP)
+    else:
+        width = 0  # native resolution
+
+    quality = args.get('q', default=STREAM_DEFAULT_QUALITY, type=int)
+    quality = min(max(quality, STREAM_QUALITY_RANGE[0]), STREAM_QUALITY_RANGE[1])
+    quality = quality // STREAM_QUALITY_STEP * STREAM_QUALITY_STEP
+
+    max_fps = args.get('fps', default=STREAM_MAX_FPS, type=float)
+    if not math.isfinite(max_fps):
+        max_fps = STREAM_MAX_FPS
+    max_fps = min(max(max_fps, 0.1), STREAM_MAX_FPS)
+    return width, quality, max_fps
+
+
+def ring_reader():
+    """Background thread: pull frames from the shared ring and annotate each once"""
+    ring = None
+    last_seq = 0
+    last_new = time.time()
+    # Ring seqs restart at 1 with every detector run; offset them so the seq
+    # seen by /stream and the variant cache only ever goes up
+    seq_base = 0
+    stream_seq = 0
+
+    while True:
+        if ring is None:
+            try:
+                ring = FrameRing.attach()
+                seq_base = stream_seq
+                last_seq = 0
+                last_new = time.time()
+                print(f"[RING] Attached to detector frames ({ring.width}x{ring.height})")
+            except (FileNotFoundError, ValueError):
+                time.sleep(RING_RETRY_SEC)
+                continue
+
+        try:
+            if ring.latest_seq() == last_seq:
+                if time.time() - last_new > RING_STALE_SEC:
+                    # Detector restarted (new segment) or stopped — re-attach
+                    print("[RING] No new frames — re-attaching")
+                    ring.close()
+                    ring = None
+                    continue
+                time.sleep(RING_POLL_SEC)
+                continue
+
+            item = ring.read_latest()
+            if item is None:
+                time.sleep(RING_POLL_SEC)
+                continue
+
+            seq, _, frame, detections = item
+            last_seq = seq
+            stream_seq = seq_base + seq
+            last_new = time.time()
+            annotated = draw_overlays(frame, detections)
+
+            with frame_cond:
+                latest_frame["seq"] = stream_seq
+                latest_frame["frame"] = annotated
+                frame_cond.notify_all()
+
+        except Exception as e:
+            print(f"[ERROR] Ring read failed: {e}")
+            ring.close()
+            ring = None
+
+
+def start_ring_reader():
+    global reader_started
+    with reader_lock:
+        if not reader_started:
+            threading.Thread(target=ring_reader, daemon=True).start()
+            reader_started = True
+
 
 @app.route('/stream')
 def stream():
-    """Stream with detection overlays"""
+    """
+    Stream with detection overlays
+    Optional query params: w (max width px), q (JPEG quality), fps (max frame rate)
+    """
+    start_ring_reader()
+    width, quality, max_fps = parse_stream_args(request.args)
+    min_interval = 1.0 / max_fps
+
     def generate():
-        """Generate annotated video stream using requests"""
-        print(f"[STREAM] Client connected! Fetching ESP32 stream: {ESP32_STREAM_URL}")
-        
-        try:
-            # Use requests to get MJPEG stream (more reliable than cv2.VideoCapture)
-            response = requests.get(ESP32_STREAM_URL, stream=True, timeout=10)
-            print("[STREAM] ESP32 stream connected successfully!")
-            
-            frame_count = 0
-            bytes_buffer = b''
-            
-            
-            for chunk in response.iter_content(chunk_size=1024):
-                bytes_buffer += chunk
-                
-                # Find JPEG boundaries
-                a = bytes_buffer.find(b'\xff\xd8')  # JPEG start
-                b = bytes_buffer.find(b'\xff\xd9')  # JPEG end
-                
-                if a != -1 and b != -1:
-                    jpg = bytes_buffer[a:b+2]
-                    bytes_buffer = bytes_buffer[b+2:]
-                    
-                    # Decode JPEG
-                    frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-                    
-                    if frame is not None:
-                        frame_count += 1
-                        if frame_count % 30 == 0:
-                            print(f"[STREAM] Streaming... frame {frame_count}")
-                        
-                        # Draw detection boxes on frame
-                        with state_lock:
-                            detections = detection_state.get("detections", [])
-                            
-                            for det in detections:
-                                label = det.get("label", "unknown")
-                                conf = det.get("conf", 0.0)
-                                tid = det.get("tid", 0)
-                                bbox = det.get("bbox", [])
-                                
-                                if len(bbox) == 4:
-                                    x1, y1, x2, y2 = bbox
-                                    
-                                    # Choose color based on label
-                                    if label == "person":
-                                        color = (0, 0, 255)  # Red for person
-                                    elif label == "boat":
-                                        color = (255, 165, 0)  # Orange for boat
-                                    else:
-                                        color = (0, 255, 0)  # Green for others
-                                    
-                                    # Draw rectangle
-                                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
-                                    
-                                    # Draw label background
-                                    label_text = f"{label}#{tid} {int(conf*100)}%"
-                                    (w, h), _ = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                                    cv2.rectangle(frame, (x1, y1-25), (x1+w+10, y1), color, -1)
-                                    
-                                    # Draw label text
-                                    cv2.putText(frame, label_text, (x1+5, y1-7),
-                                              cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                            
-                            # Draw detection status banner
-                            if detection_state.get("humanDetected", False):
-                                cv2.rectangle(frame, (10, 10), (400, 60), (0, 0, 255), -1)
-                                cv2.putText(frame, "HUMAN DETECTED!", (20, 45),
-                                          cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
-                        
-                        # Encode frame as JPEG
-                        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                        frame_bytes = buffer.tobytes()
-                        
-                        # Yield frame in MJPEG format
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        
-        except Exception as e:
-            print(f"[ERROR] Stream error: {e}")
-            # Generate error frame
-            error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-            cv2.putText(error_frame, "Stream Error", (200, 240),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
-            _, buffer = cv2.imencode('.jpg', error_frame)
-            frame_bytes = buffer.tobytes()
+        """Generate annotated video stream from frames shared by the detector"""
+        print(f"[STREAM] Client connected! w={width or 'native'} q={quality} fps<={max_fps:g}")
+
+        frame_count = 0
+        dropped = 0
+        last_seq = 0
+        last_sent = 0.0
+
+        while True:
+            # Pace to the viewer's max FPS
+            wait = min_interval - (time.time() - last_sent)
+            if wait > 0:
+                time.sleep(wait)
+
+            # Always take the newest frame: anything published while this client
+            # was paced or blocked on a slow socket is dropped, never queued
+            with frame_cond:
+                frame_cond.wait_for(lambda: latest_frame["seq"] != last_seq,
+                                    timeout=RING_STALE_SEC)
+                seq = latest_frame["seq"]
+                frame = latest_frame["frame"]
+
+            if seq == last_seq or frame is None:
+                frame_bytes = encode_frame(message_frame("Waiting for detector..."),
+                                           width, quality)
+            else:
+                if last_seq:
+                    dropped += seq - last_seq - 1
+                last_seq = seq
+                frame_count += 1
+                if frame_count % 30 == 0:
+                    print(f"[STREAM] Streaming... frame {frame_count} (seq {seq}, dropped {dropped})")
+                frame_bytes = variant_cache.get(seq, frame, width, quality)
+
+            last_sent = time.time()
+
+            # Yield frame in MJPEG format
             yield (b'--frame\r\n'
                    b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    
+
     return Response(generate(),
                    mimetype='multipart/x-mixed-replace; boundary=frame',
                    headers={
@@ -135,6 +296,162 @@ def stream():
                    })
 
 
+# Snapshots saved by the detection script (detections/ at the repo root)
+SNAPSHOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "detections"))
+THUMB_DIR = os.path.join(SNAPSHOT_DIR, ".thumbs")
+SNAPSHOT_EXTENSIONS = (".jpg", ".jpeg")
+SNAPSHOT_MAX_AGE = 86400       # snapshots never change once written
+THUMB_DEFAULT_WIDTH = 320
+THUMB_WIDTH_RANGE = (32, 800)
+THUMB_WIDTH_STEP = 16          # widths are rounded so similar requests share a thumbnail
+THUMB_QUALITY = 80
+THUMB_CACHE_BYTES = 32 * 1024 * 1024
+
+
+class ThumbnailCache:
+    """
+    Size-bounded in-memory LRU of encoded thumbnails, backed by an on-disk
+    cache in detections/.thumbs so each thumbnail is generated only once.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._items = OrderedDict()   # (name, width, src mtime_ns) -> jpeg bytes
+        self._bytes = 0
+        self._pending = {}            # key -> Lock, so concurrent requests generate once
+
+    def get(self, name, src_path, src_stat, width):
+        key = (name, width, src_stat.st_mtime_ns)
+        with self._lock:
+            data = self._lookup(key)
+            if data is not None:
+                return data
+            gen_lock = self._pending.setdefault(key, Lock())
+
+        with gen_lock:
+            with self._lock:
+                data = self._lookup(key)
+            try:
+                if data is None:
+                    data = self._load_or_generate(name, src_path, src_stat, width)
+                    with self._lock:
+                        self._store(key, data)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+            return data
+
+    def _lookup(self, key):
+        data = self._items.get(key)
+        if data is not None:
+            self._items.move_to_end(key)
+        return data
+
+    def _store(self, key, data):
+        if key in self._items or len(data) > self.max_bytes:
+            return
+        self._items[key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= len(old)
+
+    def _load_or_generate(self, name, src_path, src_stat, width):
+        stem = os.path.splitext(name)[0]
+        thumb_path = os.path.join(THUMB_DIR, f"{stem}.w{width}.jpg")
+
+        # Disk cache is valid as long as it is newer than the snapshot
+        try:
+            if os.stat(thumb_path).st_mtime_ns >= src_stat.st_mtime_ns:
+                with open(thumb_path, "rb") as f:
+                    return f.read()
+        except FileNotFoundError:
+            pass
+
+        img = cv2.imread(src_path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Cannot decode snapshot {name}")
+        data = encode_frame(img, width, THUMB_QUALITY)
+
+        try:
+            os.makedirs(THUMB_DIR, exist_ok=True)
+            tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, thumb_path)
+        except OSError as e:
+            print(f"[SNAPSHOT] Could not write thumbnail cache: {e}")
+        return data
+
+
+thumbnail_cache = ThumbnailCache(THUMB_CACHE_BYTES)
+
+
+def snapshot_path(name):
+    """Resolve a snapshot name inside SNAPSHOT_DIR, or 404"""
+    path = safe_join(SNAPSHOT_DIR, name)
+    if (path is None or os.sep in name or name.startswith(".")
+            or not name.lower().endswith(SNAPSHOT_EXTENSIONS)
+            or not os.path.isfile(path)):
+        abort(404)
+    return path
+
+
+@app.route('/snapshots', methods=['GET'])
+def snapshots():
+    """List saved snapshots, newest first"""
+    limit = request.args.get('limit', default=100, type=int)
+    items = []
+    try:
+        with os.scandir(SNAPSHOT_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(SNAPSHOT_EXTENSIONS):
+                    st = entry.stat()
+                    items.append({"name": entry.name, "size": st.st_size, "mtime": st.st_mtime})
+    except FileNotFoundError:
+        pass
+
+    items.sort(key=lambda item: item["mtime"], reverse=True)
+    return jsonify(items[:max(limit, 0)])
+
+
+@app.route('/snapshots/<name>', methods=['GET'])
+def snapshot(name):
+    """Serve a full-size snapshot (ETag / If-None-Match / Range handled by send_file)"""
+    path = snapshot_path(name)
+    return send_file(path, mimetype='image/jpeg', conditional=True,
+                     etag=True, max_age=SNAPSHOT_MAX_AGE)
+
+
+@app.route('/snapshots/<name>/thumb', methods=['GET'])
+def snapshot_thumb(name):
+    """Serve a thumbnail of a snapshot: ?w=<width px>"""
+    path = snapshot_path(name)
+    width = request.args.get('w', default=THUMB_DEFAULT_WIDTH, type=int)
+    width = min(max(width, THUMB_WIDTH_RANGE[0]), THUMB_WIDTH_RANGE[1])
+    width = width // THUMB_WIDTH_STEP * THUMB_WIDTH_STEP
+
+    st = os.stat(path)
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}-w{width}"
+
+    # Answer revalidations without touching the cache at all
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.max_age = SNAPSHOT_MAX_AGE
+        return response
+
+    try:
+        data = thumbnail_cache.get(name, path, st, width)
+    except ValueError as e:
+        print(f"[SNAPSHOT] {e}")
+        abort(404)
+
+    return send_file(io.BytesIO(data), mimetype='image/jpeg', conditional=True,
+                     etag=etag, last_modified=st.st_mtime, max_age=SNAPSHOT_MAX_AGE)
+
+
 @app.route('/status', methods=['GET'])
 def status():
     """Return current detection state"""
@@ -154,17 +471,21 @@ def update():
     try:
         data = request.json
         with state_lock:
-            # Update detection state
-            detection_state["humanDetected"] = data.get("humanDetected", False)
-            detection_state["label"] = data.get("label", "")
-            detection_state["confidence"] = data.get("confidence", 0.0)
-            detection_state["track_id"] = data.get("track_id", 0)
-            detection_state["timestamp"] = data.get("timestamp", time.time())
-            detection_state["last_image"] = data.get("last_image", "")
+            # Keep the latest snapshot name if this update has none
+            if data.get("last_image"):
+                detection_state["last_image"] = data["last_image"]
             detection_state["detections"] = data.get("detections", [])
-            
-            if data.get("humanDetected"):
-                detection_state["total_detections"] += 1
+
+            # A reacquired object was already alerted on: don't raise or count it again
+            if not data.get("reacquired", False):
+                detection_state["humanDetected"] = data.get("humanDetected", False)
+                detection_state["label"] = data.get("label", "")
+                detection_state["confidence"] = data.get("confidence", 0.0)
+                detection_state["track_id"] = data.get("track_id", 0)
+                detection_state["timestamp"] = data.get("timestamp", time.time())
+
+                if data.get("humanDetected"):
+                    detection_state["total_detections"] += 1
         
         print(f"[UPDATE] Detection received: {data.get('label')} #{data.get('track_id')} ({data.get('confidence', 0)*100:.1f}%)")
         return jsonify({"status": "ok", "message": "Detection state updated"})
@@ -202,9 +523,10 @@ if __name__ == '__main__':
     print("=" * 60)
     print("🚀 Flask Web API Server Starting...")
     print("=" * 60)
-    print(f"📡 Stream proxy: http://0.0.0.0:5000/stream")
+    print(f"📡 Stream (from detector frames): http://0.0.0.0:5000/stream")
     print(f"📊 Status endpoint: http://0.0.0.0:5000/status")
     print(f"📥 Update endpoint: http://0.0.0.0:5000/update (POST)")
+    print(f"🖼  Snapshots: http://0.0.0.0:5000/snapshots (+ /<name>, /<name>/thumb?w=)")
     print(f"💚 Health check: http://0.0.0.0:5000/health")
     print("=" * 60)
     print("\n✅ Server ready! Connect your React app to http://localhost:5000\n")
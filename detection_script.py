@@ -4,11 +4,13 @@ Milestone 5A++ (ESP32-CAM Version) - Web Integrated
 ----------------------------------
 • Reads MJPEG stream from ESP32-CAM
 • Speaks 3× per detected person (5-sec gaps)
-• Sends Telegram alerts + saves snapshots
+• Sends Telegram alerts + saves snapshots once per object (see alert_engine.py)
 • Sends detection data to Flask backend for website display
+• Publishes every frame + its detections to shared memory for the backend
 """
 
 import os, csv, time, cv2, requests, threading, random
+import numpy as np
 from datetime import datetime
 from collections import deque
 
@@ -20,11 +22,19 @@ if __name__ == '__main__':
 from ultralytics import YOLO
 import pyttsx3
 
+from alert_engine import AlertEngine, EV_CONFIRMED, EV_REACQUIRED, EV_LOST, EV_EXPIRED
+from backend.frame_ring import FrameRing
+
 # ---------- CONFIG ----------
 ESP32_STREAM_URL = "http://10.43.145.165:81/stream"   # 🔁 change this!
 MODEL_NAME = "yolov8n.pt"
 CONF_THRESHOLD = 0.4
-COOLDOWN_SEC = 2.0
+
+# Alert lifecycle: new → confirmed (alert fires) → lost → forgotten
+CONFIRM_HITS = 3          # consecutive/recent frames an object must be seen before alerting
+LOST_AFTER_SEC = 2.0
+REID_WINDOW_SEC = 10.0    # re-identify objects whose tracker ID changed within this window
+FORGET_AFTER_SEC = 30.0
 
 DETECT_CLASSES = ["person", "boat", "dog"]
 VOICE_LINES = {
@@ -90,7 +100,7 @@ def send_telegram_async(img_path, conf, label, track_id):
     threading.Thread(target=worker, daemon=True).start()
 
 # ----- WEB INTEGRATION -----
-def update_web_status(label, conf, tid, bbox):
+def update_web_status(label, conf, tid, bbox, img_name="", reacquired=False):
     """Send detection data to Flask backend for website display"""
     global current_web_detections
     
@@ -114,6 +124,8 @@ def update_web_status(label, conf, tid, bbox):
         "confidence": conf,
         "track_id": tid,
         "timestamp": datetime.now().isoformat(),
+        "last_image": img_name,  # served by backend at /snapshots/<name>
+        "reacquired": reacquired,  # known object back in view — not a new detection
         "detections": current_web_detections
     }
     
@@ -132,6 +144,7 @@ print("🔄 Loading YOLOv8n model...")
 model = YOLO(MODEL_NAME)
 names = model.names
 wanted_ids = {cid for cid, name in names.items() if name in DETECT_CLASSES}
+wanted_id_array = np.array(sorted(wanted_ids), dtype=np.int32)
 print("✅ Model loaded. Tracking:", [names[i] for i in wanted_ids])
 
 cap = cv2.VideoCapture(ESP32_STREAM_URL)
@@ -139,11 +152,35 @@ if not cap.isOpened():
     raise SystemExit(f"❌ Cannot open ESP32-CAM stream: {ESP32_STREAM_URL}")
 print("✅ Connected to ESP32-CAM stream.")
 
-# Tracking memory
-last_alert = {}
+# Shared frame ring — web backend reads frames from here instead of the camera
+frame_ring = FrameRing.create(FRAME_WIDTH, FRAME_HEIGHT)
+print("✅ Frame ring ready for web backend.")
+
+# Tracking memory (keyed by stable alert ID, not tracker ID)
+alert_engine = AlertEngine(confirm_hits=CONFIRM_HITS, lost_after=LOST_AFTER_SEC,
+                           reid_window=REID_WINDOW_SEC, forget_after=FORGET_AFTER_SEC)
 track_colors = {}
 trail_memory = {}
-speech_memory = {}   # {tid: {"spoken": bool}}
+
+
+def raise_alert(alert, frame):
+    """Side effects for a newly confirmed object: snapshot, log, Telegram, voice, web"""
+    label, conf, aid = alert.label, alert.conf, alert.alert_id
+    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    img_name = f"{label}{aid}{ts}_{int(conf*100)}.jpg"
+    img_path = os.path.join(OUTPUT_DIR, img_name)
+    cv2.imwrite(img_path, frame)
+    alert.snapshot = img_name
+    with open(LOG_FILE, "a", newline="") as f:
+        csv.writer(f).writerow([ts, label, f"{conf:.3f}", aid, img_path])
+    print(f"[SNAP] {label}#{aid} ({conf:.2f}) saved")
+    send_telegram_async(img_path, conf, label, aid)
+
+    print(f"[VOICE] New {label}#{aid} confirmed → starting 3× speech")
+    speak_threaded(label, aid)
+
+    # Send to web backend
+    update_web_status(label, conf, aid, alert.bbox, img_name)
 
 fps_time = time.time()
 
@@ -159,63 +196,79 @@ try:
 
         frame = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT))
         results = model.track(frame, persist=True, conf=CONF_THRESHOLD, verbose=False)
-        annotated = results[0].plot()
+        annotated = frame.copy()
 
         # Clear current detections at start of each frame
         current_web_detections = []
+        frame_detections = []
+
+        boxes = results[0].boxes
+        if boxes is not None and len(boxes) > 0:
+            # One tensor → NumPy transfer per field for the whole frame
+            xyxy = boxes.xyxy.cpu().numpy().astype(np.int32)
+            cids = boxes.cls.cpu().numpy().astype(np.int32)
+            confs = boxes.conf.cpu().numpy()
+            tids = (boxes.id.cpu().numpy().astype(np.int64) if boxes.id is not None
+                    else np.arange(len(cids)))
+
+            keep = np.isin(cids, wanted_id_array)
+            xyxy, cids, confs, tids = xyxy[keep], cids[keep], confs[keep], tids[keep]
+            centers = (xyxy[:, :2] + xyxy[:, 2:]) // 2
+            bboxes = xyxy.tolist()
+            labels = [names[cid] for cid in cids.tolist()]
+            confs = confs.tolist()
+        else:
+            centers = np.empty((0, 2), dtype=np.int32)
+            bboxes, labels, confs, tids = [], [], [], np.empty(0, dtype=np.int64)
+
+        # Map tracker IDs to deduplicated alerts; side effects only on transitions
+        alert_ids, events = alert_engine.update(frame, labels, confs, tids.tolist(),
+                                                bboxes, time.time())
+
+        for (x1, y1, x2, y2), label, conf, aid, (cx, cy) in zip(
+                bboxes, labels, confs, alert_ids, centers.tolist()):
+            frame_detections.append({
+                "bbox": [x1, y1, x2, y2],
+                "label": label,
+                "conf": conf,
+                "tid": aid
+            })
+
+            # unique color
+            if aid not in track_colors:
+                track_colors[aid] = (random.randint(0,255),
+                                     random.randint(0,255),
+                                     random.randint(0,255))
+            color = track_colors[aid]
+
+            # motion trail
+            if aid not in trail_memory:
+                trail_memory[aid] = deque(maxlen=20)
+            trail_memory[aid].append((cx, cy))
+
+            # Single render pass: box, label and trail
+            cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+            cv2.putText(annotated, f"{label}#{aid} {conf:.2f}", (x1, y1-10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+            if len(trail_memory[aid]) > 1:
+                cv2.polylines(annotated, [np.array(trail_memory[aid], dtype=np.int32)],
+                              False, color, 2)
+
+        for event, alert in events:
+            if event == EV_CONFIRMED:
+                raise_alert(alert, frame)
+            elif event == EV_REACQUIRED:
+                print(f"[ALERT] {alert.label}#{alert.alert_id} back in view")
+                update_web_status(alert.label, alert.conf, alert.alert_id, alert.bbox,
+                                  alert.snapshot, reacquired=True)
+            elif event == EV_LOST:
+                print(f"[ALERT] {alert.label}#{alert.alert_id} lost")
+            elif event == EV_EXPIRED:
+                track_colors.pop(alert.alert_id, None)
+                trail_memory.pop(alert.alert_id, None)
 
-        if hasattr(results[0], "boxes") and len(results[0].boxes) > 0:
-            boxes = results[0].boxes
-            for i, box in enumerate(boxes.xyxy):
-                cid = int(boxes.cls[i].item())
-                conf = float(boxes.conf[i].item())
-                tid = int(boxes.id[i].item()) if boxes.id is not None else i
-
-                if cid in wanted_ids:
-                    label = names[cid]
-                    x1, y1, x2, y2 = map(int, box.tolist())
-
-                    # unique color
-                    if tid not in track_colors:
-                        track_colors[tid] = (random.randint(0,255),
-                                             random.randint(0,255),
-                                             random.randint(0,255))
-                    color = track_colors[tid]
-                    cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
-                    cv2.putText(annotated, f"{label}#{tid}", (x1, y1-10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-
-                    # motion trail
-                    cx, cy = int((x1+x2)/2), int((y1+y2)/2)
-                    if tid not in trail_memory:
-                        trail_memory[tid] = deque(maxlen=20)
-                    trail_memory[tid].append((cx, cy))
-                    for j in range(1, len(trail_memory[tid])):
-                        cv2.line(annotated, trail_memory[tid][j-1],
-                                 trail_memory[tid][j], color, 2)
-
-                    # --- Smart Voice Logic ---
-                    if tid not in speech_memory:
-                        speech_memory[tid] = {"spoken": False}
-                        print(f"[VOICE] New {label}#{tid} detected → starting 3× speech")
-                        speak_threaded(label, tid)
-                        speech_memory[tid]["spoken"] = True
-
-                    # --- Telegram + Snapshot ---
-                    now = time.time()
-                    if tid not in last_alert or now - last_alert[tid] > COOLDOWN_SEC:
-                        ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-                        img_name = f"{label}{tid}{ts}_{int(conf*100)}.jpg"
-                        img_path = os.path.join(OUTPUT_DIR, img_name)
-                        cv2.imwrite(img_path, frame)
-                        with open(LOG_FILE, "a", newline="") as f:
-                            csv.writer(f).writerow([ts, label, f"{conf:.3f}", tid, img_path])
-                        print(f"[SNAP] {label}#{tid} ({conf:.2f}) saved")
-                        send_telegram_async(img_path, conf, label, tid)
-                        last_alert[tid] = now
-                        
-                        # Send to web backend
-                        update_web_status(label, conf, tid, [x1, y1, x2, y2])
+        # Publish the raw frame with the detections computed on it
+        frame_ring.publish(frame, frame_detections)
 
         # Show FPS
         fps = 1.0 / max(1e-6, time.time() - fps_time)
@@ -228,5 +281,6 @@ try:
 
 finally:
     cap.release()
+    frame_ring.close()
     cv2.destroyAllWindows()
     print("🔚 Exiting gracefully.")